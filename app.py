@@ -1,43 +1,109 @@
+import io
 import os
+import json
+import time
 import uuid
-from flask import Flask, request, jsonify, render_template, Response, send_from_directory
+import hmac
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Blueprint, Flask, current_app, request, jsonify, render_template, Response, send_from_directory, url_for
+from flask.json.provider import JSONProvider
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
-from datetime import datetime, timedelta, timezone
-from functools import wraps
+from functools import wraps, lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
 
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
+from azure.storage.blob import BlobServiceClient
 from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport
 from openai import AzureOpenAI
-from docx import Document
-from reportlab.pdfgen import canvas
+import numpy as np
+import orjson
+import tiktoken
 from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Paragraph
 
 # Load environment variables
 load_dotenv()
-AZURE_STORAGE_CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
-AZURE_BLOB_CONTAINER = os.getenv("AZURE_BLOB_CONTAINER")
-AZURE_FORMRECOGNIZER_ENDPOINT = os.getenv("AZURE_FORMRECOGNIZER_ENDPOINT")
-AZURE_FORMRECOGNIZER_KEY = os.getenv("AZURE_FORMRECOGNIZER_KEY")
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
-AZURE_OPENAI_API_VERSION = "2024-12-01-preview"
-APP_USERNAME = os.getenv("APP_USERNAME")
-APP_PASSWORD = os.getenv("APP_PASSWORD")
-
-app = Flask(__name__)
-app.config["UPLOAD_FOLDER"] = "uploads"
-app.config["SUMMARY_FOLDER"] = "summaries"
-app.config["MAX_CONTENT_LENGTH"] = 5 * 1024 * 1024  # 5MB limit
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
-os.makedirs(app.config["SUMMARY_FOLDER"], exist_ok=True)
+
+@dataclass(frozen=True)
+class Config:
+    storage_connection_string: str
+    blob_container: str
+    formrecognizer_endpoint: str
+    formrecognizer_key: str
+    openai_endpoint: str
+    openai_api_key: str
+    openai_deployment: str
+    openai_embedding_deployment: str
+    archive_uploads: bool
+    app_username: str
+    app_password: str
+    openai_api_version: str = "2024-12-01-preview"
+    summary_folder: str = "summaries"
+    ocr_cache_folder: str = os.path.join("summaries", "ocr")
+    cache_path: str = os.path.join("data", "llm_cache.json")
+    max_content_length: int = 5 * 1024 * 1024  # 5MB limit
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            storage_connection_string=os.getenv("AZURE_STORAGE_CONNECTION_STRING"),
+            blob_container=os.getenv("AZURE_BLOB_CONTAINER"),
+            formrecognizer_endpoint=os.getenv("AZURE_FORMRECOGNIZER_ENDPOINT"),
+            formrecognizer_key=os.getenv("AZURE_FORMRECOGNIZER_KEY"),
+            openai_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            openai_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+            openai_embedding_deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
+            archive_uploads=os.getenv("ARCHIVE") == "1",
+            app_username=os.getenv("APP_USERNAME"),
+            app_password=os.getenv("APP_PASSWORD")
+        )
+
+@lru_cache(maxsize=None)
+def get_config():
+    return Config.from_env()
+
+class OrjsonProvider(JSONProvider):
+    # orjson serializes long summary strings much faster than the stdlib encoder
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+bp = Blueprint("main", __name__)
 
 # Auth setup
+@lru_cache(maxsize=None)
+def credentials():
+    config = get_config()
+    if not (config.app_username and config.app_password):
+        return None
+    return config.app_username.encode("utf-8"), config.app_password.encode("utf-8")
+
 def check_auth(username, password):
-    return username == APP_USERNAME and password == APP_PASSWORD
+    expected = credentials()
+    if expected is None:
+        return False
+    # Compare both fields in constant time so timing doesn't reveal which one differs
+    username_ok = hmac.compare_digest((username or "").encode("utf-8"), expected[0])
+    password_ok = hmac.compare_digest((password or "").encode("utf-8"), expected[1])
+    return username_ok & password_ok
 
 def authenticate():
     return Response(
@@ -56,68 +122,393 @@ def requires_auth(f):
     return decorated
 
 # Azure clients
-blob_service_client = BlobServiceClient.from_connection_string(AZURE_STORAGE_CONNECTION_STRING)
-form_recognizer_client = DocumentAnalysisClient(
-    endpoint=AZURE_FORMRECOGNIZER_ENDPOINT,
-    credential=AzureKeyCredential(AZURE_FORMRECOGNIZER_KEY)
+def pooled_transport(pool_size=64):
+    # requests defaults to 10 connections per host, which threaded workers exhaust;
+    # retries stay disabled here because the Azure pipeline handles them
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=False, redirect=False, raise_on_status=False)
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return RequestsTransport(session=session, session_owner=False)
+
+# Blob storage is only used to archive uploads for audit when ARCHIVE=1.
+# Uploads above 1MB are split into blocks that are sent in parallel.
+BLOB_BLOCK_SIZE = 1024 * 1024
+
+@lru_cache(maxsize=None)
+def get_blob_client():
+    return BlobServiceClient.from_connection_string(
+        get_config().storage_connection_string,
+        transport=pooled_transport(),
+        max_single_put_size=BLOB_BLOCK_SIZE,
+        max_block_size=BLOB_BLOCK_SIZE
+    )
+
+@lru_cache(maxsize=None)
+def get_form_client():
+    config = get_config()
+    return DocumentAnalysisClient(
+        endpoint=config.formrecognizer_endpoint,
+        credential=AzureKeyCredential(config.formrecognizer_key),
+        transport=pooled_transport()
+    )
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    config = get_config()
+    return AzureOpenAI(
+        api_key=config.openai_api_key,
+        azure_endpoint=config.openai_endpoint,
+        api_version=config.openai_api_version,
+        # Sized for threaded workers plus the map-reduce fan-out; HTTP/2 multiplexes requests per connection
+        http_client=httpx.Client(
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            http2=True,
+            timeout=60
+        )
+    )
+
+def load_embedding(value):
+    if value is None:
+        return None
+    embedding = np.asarray(value, dtype=np.float32)
+    if embedding.ndim != 1 or not embedding.size:
+        raise ValueError("embedding must be a non-empty vector")
+    return embedding
+
+# Summary cache: exact match on the SHA-256 of the extracted text, then
+# cosine similarity over embeddings for near-duplicate documents.
+# Each worker process keeps its own copy; the file is a snapshot of whichever
+# process saved last and only seeds new processes on startup.
+class SummaryCache:
+    def __init__(self, path, threshold=0.92, max_entries=256, ttl=7 * 24 * 3600):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Row i of _matrix is the normalized embedding of _matrix_keys[i]
+        self._matrix_keys = []
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        # Saves run on one background thread and coalesce while one is pending
+        self._save_executor = ThreadPoolExecutor(max_workers=1)
+        self._save_pending = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            entries = OrderedDict()
+            for entry in data:
+                # Validate every field _evict and the lookups rely on; a malformed file is discarded
+                entries[str(entry["sha256"])] = {
+                    "sha256": str(entry["sha256"]),
+                    "embedding": load_embedding(entry["embedding"]),
+                    "summary": str(entry["summary"]),
+                    "created": float(entry["created"]),
+                }
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        self._entries = entries
+        self._evict()
+        self._rebuild_matrix()
+
+    def _rebuild_matrix(self):
+        # Called with _lock held (or before the cache is shared). Only embeddings with the
+        # newest entry's dimension are indexed, so a switched deployment can't mix shapes.
+        embedded = [(k, e["embedding"]) for k, e in self._entries.items() if e["embedding"] is not None]
+        if not embedded:
+            self._matrix_keys = []
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+            return
+        dim = max(embedded, key=lambda item: self._entries[item[0]]["created"])[1].shape[0]
+        embedded = [(k, emb) for k, emb in embedded if emb.shape[0] == dim]
+        self._matrix_keys = [k for k, _ in embedded]
+        self._matrix = np.stack([emb for _, emb in embedded])
+
+    def _schedule_save(self):
+        # Called with _lock held
+        if not self._save_pending:
+            self._save_pending = True
+            self._save_executor.submit(self._save)
+
+    def _save(self):
+        with self._lock:
+            self._save_pending = False
+            entries = [
+                {**e, "embedding": e["embedding"].tolist() if e["embedding"] is not None else None}
+                for e in self._entries.values()
+            ]
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # Persistence is best-effort; the in-memory cache stays valid
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        evicted = False
+        cutoff = time.time() - self.ttl
+        for key in [k for k, e in self._entries.items() if e["created"] < cutoff]:
+            del self._entries[key]
+            evicted = True
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            evicted = True
+        if evicted:
+            self._rebuild_matrix()
+
+    def get_exact(self, sha256):
+        with self._lock:
+            self._evict()
+            entry = self._entries.get(sha256)
+            if entry is None:
+                return None
+            self._entries.move_to_end(sha256)
+            return entry["summary"]
+
+    def get_similar(self, embedding):
+        with self._lock:
+            self._evict()
+            keys, matrix = self._matrix_keys, self._matrix
+        # The matrix is replaced rather than mutated, so the product can run outside the lock
+        if not keys or matrix.shape[1] != embedding.shape[0]:
+            return None
+        sims = matrix @ embedding
+        best = int(np.argmax(sims))
+        if sims[best] <= self.threshold:
+            return None
+        with self._lock:
+            entry = self._entries.get(keys[best])
+            if entry is None:
+                return None
+            self._entries.move_to_end(keys[best])
+            return entry["summary"]
+
+    def put(self, sha256, embedding, summary):
+        with self._lock:
+            self._entries[sha256] = {
+                "sha256": sha256,
+                "embedding": embedding,
+                "summary": summary,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(sha256)
+            self._evict()
+            self._rebuild_matrix()
+            self._schedule_save()
+
+@lru_cache(maxsize=None)
+def get_summary_cache():
+    return SummaryCache(get_config().cache_path)
+
+# Embedding models accept 8191 tokens; o200k counts run lower than the cl100k tokenizer
+# those models use, so stop well short of the limit
+EMBEDDING_TOKENS = 7000
+
+def embedding_input(text):
+    # Embed as much of the document as the model accepts: a short prefix is mostly
+    # template boilerplate and would make different contracts look identical
+    encoding = token_encoding()
+    if encoding is None:
+        return text[:EMBEDDING_TOKENS * 3]
+    tokens = encoding.encode(text)
+    if len(tokens) <= EMBEDDING_TOKENS:
+        return text
+    return encoding.decode(next(split_tokens(encoding, tokens, EMBEDDING_TOKENS)))
+
+def embed_text(text):
+    # The semantic layer is opt-in: Azure deployment names are user-chosen, so there is no safe default
+    deployment = get_config().openai_embedding_deployment
+    if not deployment:
+        return None
+    try:
+        response = get_openai_client().embeddings.create(
+            model=deployment,
+            input=embedding_input(text)
+        )
+    except Exception:
+        # The semantic layer is best-effort; fall back to exact matching only
+        return None
+    embedding = np.array(response.data[0].embedding, dtype=np.float32)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm else None
+
+SUMMARY_PROMPT = (
+    "You are a legal assistant. Summarize the following legal document and extract key clauses, "
+    "dates, parties involved, and obligations:\n\n"
+)
+CHUNK_PROMPT = (
+    "You are a legal assistant. Summarize the following section of a legal document and note any "
+    "clauses, dates, parties involved, and obligations it contains:\n\n"
 )
-openai_client = AzureOpenAI(
-    api_key=AZURE_OPENAI_API_KEY,
-    azure_endpoint=AZURE_OPENAI_ENDPOINT,
-    api_version=AZURE_OPENAI_API_VERSION
+REDUCE_PROMPT = (
+    "You are a legal assistant. The following are summaries of consecutive sections of one legal document. "
+    "Combine them into a single summary and extract key clauses, dates, parties involved, and obligations:\n\n"
 )
+CHUNK_TOKENS = 4000
+llm_executor = ThreadPoolExecutor(max_workers=8)
 
-def split_text(text, max_length):
-    words = text.split()
-    lines = []
-    line = ""
-    for word in words:
-        if len(line) + len(word) + 1 <= max_length:
-            line += (" " if line else "") + word
-        else:
-            lines.append(line)
-            line = word
-    if line:
-        lines.append(line)
-    return lines
-
-def convert_docx_to_pdf(docx_path, pdf_path):
-    doc = Document(docx_path)
-    c = canvas.Canvas(pdf_path, pagesize=letter)
-    width, height = letter
-    y = height - inch
-    for para in doc.paragraphs:
-        text = para.text.strip()
-        if text:
-            lines = split_text(text, 90)
-            for line in lines:
-                c.drawString(inch, y, line)
-                y -= 14
-                if y < inch:
-                    c.showPage()
-                    y = height - inch
-    c.save()
-
-def upload_to_blob(file_path, filename):
-    blob_client = blob_service_client.get_blob_client(container=AZURE_BLOB_CONTAINER, blob=filename)
-    with open(file_path, "rb") as data:
-        blob_client.upload_blob(data, overwrite=True)
-    sas_token = generate_blob_sas(
-        account_name=blob_client.account_name,
-        container_name=AZURE_BLOB_CONTAINER,
-        blob_name=filename,
-        account_key=blob_service_client.credential.account_key,
-        permission=BlobSasPermissions(read=True),
-        expiry=datetime.now(timezone.utc) + timedelta(minutes=10)
+@lru_cache(maxsize=None)
+def token_encoding():
+    # tiktoken downloads its BPE files on first use (with no timeout), so this is loaded at
+    # import; a failure is remembered as None and chunking falls back to character counts
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS):
+    encoding = token_encoding()
+    if encoding is None:
+        # Approximate 4 chars per token
+        size = max_tokens * 4
+        return [text[i:i + size] for i in range(0, len(text), size)] or [text]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return [text]
+    return [encoding.decode(piece) for piece in split_tokens(encoding, tokens, max_tokens)]
+
+def split_tokens(encoding, tokens, max_tokens):
+    # Yield slices of at most max_tokens, moving each boundary back so that a multi-byte
+    # character split across tokens is never cut in half (which would decode to U+FFFD)
+    start = 0
+    while start < len(tokens):
+        end = min(start + max_tokens, len(tokens))
+        while end < len(tokens) and end - start > 1 and not decodes_cleanly(encoding, tokens[start:end]):
+            end -= 1
+        yield tokens[start:end]
+        start = end
+
+def decodes_cleanly(encoding, tokens):
+    try:
+        encoding.decode_bytes(tokens).decode("utf-8")
+    except UnicodeDecodeError:
+        return False
+    return True
+
+def chat_messages(prompt):
+    return [
+        {"role": "system", "content": "You are a helpful legal assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+def complete(prompt):
+    chat_response = get_openai_client().chat.completions.create(
+        model=get_config().openai_deployment,
+        messages=chat_messages(prompt)
     )
-    return f"https://{blob_client.account_name}.blob.core.windows.net/{AZURE_BLOB_CONTAINER}/{filename}?{sas_token}"
+    return chat_response.choices[0].message.content.strip()
+
+def stream_completion(prompt):
+    chat_response = get_openai_client().chat.completions.create(
+        model=get_config().openai_deployment,
+        messages=chat_messages(prompt),
+        stream=True
+    )
+    for event in chat_response:
+        # Azure sends content-filter events with no choices
+        if event.choices and event.choices[0].delta.content:
+            yield event.choices[0].delta.content
+
+def stream_summary(extracted_text):
+    summary_cache = get_summary_cache()
+    text_hash = hashlib.sha256(extracted_text.encode("utf-8")).hexdigest()
+    cached = summary_cache.get_exact(text_hash)
+    if cached is not None:
+        yield cached
+        return
+
+    embedding = embed_text(extracted_text)
+    if embedding is not None:
+        cached = summary_cache.get_similar(embedding)
+        if cached is not None:
+            yield cached
+            return
+
+    chunks = chunk_text(extracted_text)
+    if len(chunks) > 1:
+        # Map-reduce: summarize sections in parallel, then stream the merged summary
+        partials = list(llm_executor.map(lambda chunk: complete(CHUNK_PROMPT + chunk), chunks))
+        prompt = REDUCE_PROMPT + "\n\n".join(partials)
+    else:
+        prompt = SUMMARY_PROMPT + extracted_text
+
+    pieces = []
+    for piece in stream_completion(prompt):
+        pieces.append(piece)
+        yield piece
+
+    summary_cache.put(text_hash, embedding, "".join(pieces).strip())
+
+PDF_BODY_STYLE = getSampleStyleSheet()["BodyText"]
+
+def render_pdf(text, out_path):
+    # Each non-empty line becomes a paragraph; reportlab handles wrapping and page breaks
+    paragraphs = [Paragraph(escape(line.strip()), PDF_BODY_STYLE) for line in text.splitlines() if line.strip()]
+    SimpleDocTemplate(out_path, pagesize=letter).build(paragraphs)
+
+def write_txt(text, out_path):
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+output_executor = ThreadPoolExecutor(max_workers=8)
+
+# Render once at import so font metrics are loaded before the first request
+render_pdf("warm", io.BytesIO())
+# Load the tokenizer once here (in the gunicorn master with --preload) rather than inside a request
+token_encoding()
+
+def upload_to_blob(data, filename):
+    blob_client = get_blob_client().get_blob_client(container=get_config().blob_container, blob=filename)
+    blob_client.upload_blob(data, length=len(data), overwrite=True, max_concurrency=8)
+
+def extract_text(data, file_ext):
+    # Form Recognizer reads .docx natively, so the original bytes are analysed as-is
+    if get_config().archive_uploads:
+        upload_to_blob(data, f"{uuid.uuid4()}{file_ext}")
 
-@app.route("/")
+    # Poll every second instead of the SDK default of 5s; small documents finish in 1-3s
+    poller = get_form_client().begin_analyze_document("prebuilt-read", document=data, polling_interval=1)
+    result = poller.result()
+
+    return "\n".join(line.content for page in result.pages for line in page.lines)
+
+def write_ocr_cache(path, text):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Caching is best-effort; a failed write must not fail a request that already has its text
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def sse_event(payload):
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+@bp.route("/")
 @requires_auth
 def index():
     return render_template("index.html")
 
-@app.route("/upload", methods=["POST"])
+@bp.route("/upload", methods=["POST"])
 @requires_auth
 def upload_file():
     file = request.files.get("file")
@@ -130,71 +521,108 @@ def upload_file():
     if file_ext not in [".pdf", ".doc", ".docx"]:
         return jsonify({"error": "Unsupported file type"}), 400
 
-    temp_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file.save(temp_path)
+    # Uploads are capped at 5MB, so keep them in memory instead of writing to disk
+    data = file.read()
 
-    if file_ext == ".docx":
-        pdf_filename = f"{uuid.uuid4()}.pdf"
-        pdf_path = os.path.join(app.config["UPLOAD_FOLDER"], pdf_filename)
-        convert_docx_to_pdf(temp_path, pdf_path)
-        upload_name = pdf_filename
-        file_path_to_upload = pdf_path
-    else:
-        upload_name = f"{uuid.uuid4()}{file_ext}"
-        file_path_to_upload = temp_path
+    # OCR output is cached by the SHA-256 of the uploaded bytes
+    file_hash = hashlib.sha256(data).hexdigest()
+    ocr_cache_path = os.path.join(current_app.config["OCR_CACHE_FOLDER"], f"{file_hash}.txt")
 
     try:
-        blob_url = upload_to_blob(file_path_to_upload, upload_name)
+        if os.path.exists(ocr_cache_path):
+            with open(ocr_cache_path, "r", encoding="utf-8") as f:
+                extracted_text = f.read()
+        else:
+            extracted_text = extract_text(data, file_ext)
+            write_ocr_cache(ocr_cache_path, extracted_text)
 
-        poller = form_recognizer_client.begin_analyze_document_from_url("prebuilt-document", blob_url)
-        result = poller.result()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        extracted_text = ""
-        for page in result.pages:
-            for line in page.lines:
-                extracted_text += line.content + "\n"
+    # Name outputs per request so concurrent uploads don't overwrite each other
+    summary_folder = current_app.config["SUMMARY_FOLDER"]
+    summary_id = uuid.uuid4().hex
+    txt_name = f"summary_{summary_id}.txt"
+    pdf_name = f"summary_{summary_id}.pdf"
+    downloads = {
+        "txt": url_for("main.download_summary", filename=txt_name),
+        "pdf": url_for("main.download_summary", filename=pdf_name)
+    }
 
-        prompt = (
-            "You are a legal assistant. Summarize the following legal document and extract key clauses, "
-            "dates, parties involved, and obligations:\n\n" + extracted_text
-        )
+    def generate():
+        pieces = []
+        try:
+            for piece in stream_summary(extracted_text):
+                pieces.append(piece)
+                yield sse_event({"delta": piece})
 
-        chat_response = openai_client.chat.completions.create(
-            model=AZURE_OPENAI_DEPLOYMENT,
-            messages=[
-                {"role": "system", "content": "You are a helpful legal assistant."},
-                {"role": "user", "content": prompt}
-            ]
-        )
+            summary_text = "".join(pieces).strip()
 
-        summary_text = chat_response.choices[0].message.content.strip()
+            # Save TXT and PDF concurrently; both must exist before the links are sent
+            txt_path = os.path.join(summary_folder, txt_name)
+            pdf_path = os.path.join(summary_folder, pdf_name)
+            writes = [
+                output_executor.submit(write_txt, summary_text, txt_path),
+                output_executor.submit(render_pdf, summary_text, pdf_path)
+            ]
+            for write in writes:
+                write.result()
 
-        # Save TXT
-        txt_path = os.path.join(app.config["SUMMARY_FOLDER"], "summary.txt")
-        with open(txt_path, "w", encoding="utf-8") as f:
-            f.write(summary_text)
+            yield sse_event({"done": True, **downloads})
+        except Exception as e:
+            yield sse_event({"error": str(e)})
 
-        # Save PDF
-        pdf_path = os.path.join(app.config["SUMMARY_FOLDER"], "summary.pdf")
-        c = canvas.Canvas(pdf_path, pagesize=letter)
-        y = letter[1] - inch
-        for line in split_text(summary_text, 90):
-            c.drawString(inch, y, line)
-            y -= 14
-            if y < inch:
-                c.showPage()
-                y = letter[1] - inch
-        c.save()
+    # Stream the summary as server-sent events while the model generates it
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        return jsonify({"summary": summary_text})
+def remove_older_than(folder, cutoff, prefix=""):
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.name.startswith(prefix):
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except OSError:
+                    # Another worker may have removed it already
+                    pass
+    except OSError:
+        pass
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+def cleanup_summaries(summary_folder, ocr_cache_folder, max_age=3600, ocr_max_age=7 * 24 * 3600, interval=600):
+    # Per-request summaries are only needed long enough to be downloaded;
+    # cached OCR text is kept longer so re-uploads can still skip Form Recognizer
+    while True:
+        now = time.time()
+        remove_older_than(summary_folder, now - max_age, prefix="summary_")
+        remove_older_than(ocr_cache_folder, now - ocr_max_age)
+        time.sleep(interval)
 
-@app.route("/download/<filename>")
+@bp.route("/download/<filename>")
 @requires_auth
 def download_summary(filename):
-    return send_from_directory(app.config["SUMMARY_FOLDER"], filename, as_attachment=True)
+    return send_from_directory(current_app.config["SUMMARY_FOLDER"], filename, as_attachment=True)
+
+def create_app():
+    config = get_config()
+    app = Flask(__name__)
+    app.json = OrjsonProvider(app)
+    app.config["SUMMARY_FOLDER"] = config.summary_folder
+    app.config["OCR_CACHE_FOLDER"] = config.ocr_cache_folder
+    app.config["MAX_CONTENT_LENGTH"] = config.max_content_length
+    os.makedirs(config.summary_folder, exist_ok=True)
+    os.makedirs(config.ocr_cache_folder, exist_ok=True)
+    os.makedirs(os.path.dirname(config.cache_path), exist_ok=True)
+    app.register_blueprint(bp)
+    threading.Thread(target=cleanup_summaries, args=(config.summary_folder, config.ocr_cache_folder), daemon=True).start()
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))